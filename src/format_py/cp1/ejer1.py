@@ -1,24 +1,39 @@
-import nltk
 import string
-from nltk.tokenize import word_tokenize
-from nltk.corpus import stopwords
-from nltk.stem import SnowballStemmer
+
+
+def verificar_recurso_nltk(ruta, nombre):
+    """Comprueba en la caché local de NLTK que un recurso esté instalado"""
+    import nltk
+
+    try:
+        nltk.data.find(ruta)
+    except LookupError:
+        raise LookupError(
+            f"Recurso de NLTK '{nombre}' no encontrado. "
+            f"Instálalo con: python -m nltk.downloader {nombre}"
+        ) from None
 
 
 class ProcesadorTextoBasico:
     def __init__(self):
-        # Descargar recursos necesarios de NLTK
-        nltk.download('punkt', quiet=True)
-        nltk.download('stopwords', quiet=True)
+        # Verificar recursos necesarios de NLTK (solo caché local, sin red)
+        verificar_recurso_nltk('tokenizers/punkt', 'punkt')
+        verificar_recurso_nltk('corpora/stopwords', 'stopwords')
+
+        # NLTK se importa aquí y no al cargar el módulo
+        from nltk.tokenize import word_tokenize
+        from nltk.corpus import stopwords
+        from nltk.stem import SnowballStemmer
 
         # Inicializar componentes para español
+        self.tokenizar = word_tokenize
         self.stemmer = SnowballStemmer('spanish')
         self.stop_words = set(stopwords.words('spanish'))
         self.puntuacion = set(string.punctuation)
 
     def procesar_texto(self, texto):
         # Tokenización y conversión a minúsculas
-        tokens = word_tokenize(texto, language='spanish')
+        tokens = self.tokenizar(texto, language='spanish')
         tokens_minusculas = [token.lower() for token in tokens]
 
         # Filtrar puntuación y stopwords
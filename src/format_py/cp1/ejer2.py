@@ -1,30 +1,21 @@
 import re
-from nltk.util import ngrams
-import spacy
-import subprocess
-import sys
 
 
 def verificar_instalar_spacy_model():
-    """Verifica e instala el modelo de spaCy si es necesario"""
+    """Verifica que el modelo de spaCy esté instalado localmente (no descarga nada)"""
+    # spaCy se importa aquí para que importar el módulo sea barato
+    import spacy
+
     try:
         nlp = spacy.load("es_core_news_sm")
         return nlp
     except OSError:
-        print("Modelo es_core_news_sm no encontrado. Instalando...")
-        try:
-            # Intentar instalar el modelo
-            subprocess.check_call([sys.executable, "-m", "spacy", "download", "es_core_news_sm"])
-            nlp = spacy.load("es_core_news_sm")
-            print("Modelo instalado correctamente.")
-            return nlp
-        except Exception as e:
-            print(f"Error instalando el modelo: {e}")
-            print("\nSOLUCIÓN ALTERNATIVA:")
-            print("1. Ejecuta en la terminal: python -m spacy download es_core_news_sm")
-            print(
-                "2. O instala con: pip install https://github.com/explosion/spacy-models/releases/download/es_core_news_sm-3.7.0/es_core_news_sm-3.7.0-py3-none-any.whl")
-            return None
+        print("Modelo es_core_news_sm no encontrado en la instalación local.")
+        print("\nSOLUCIÓN:")
+        print("1. Ejecuta en la terminal: python -m spacy download es_core_news_sm")
+        print(
+            "2. O instala con: pip install https://github.com/explosion/spacy-models/releases/download/es_core_news_sm-3.7.0/es_core_news_sm-3.7.0-py3-none-any.whl")
+        return None
 
 
 class ProcesadorAvanzado:
@@ -38,7 +29,7 @@ class ProcesadorAvanzado:
         return re.findall(patron, texto)
 
     def generar_ngramas(self, tokens, n):
-        return list(ngrams(tokens, n))
+        return list(zip(*(tokens[i:] for i in range(n))))
 
     def lematizar(self, texto):
         if self.nlp is None:
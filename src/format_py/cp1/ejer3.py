@@ -1,4 +1,3 @@
-import pandas as pd
 from collections import Counter
 
 
@@ -29,6 +28,8 @@ class ModeloEspacioVectorial:
 
     def construir_matriz(self):
         """Construye la matriz término-documento"""
+        import pandas as pd
+
         if not self.documentos:
             return pd.DataFrame()
 
@@ -1,31 +1,140 @@
 import re
-import pandas as pd
 from collections import Counter
-import spacy
-from nltk.util import ngrams
-from nltk.corpus import stopwords as nltk_stopwords
-import nltk
+from functools import lru_cache
 
-# Descargar stopwords si no están disponibles
-try:
-    nltk_stopwords.words('spanish')
-    nltk_stopwords.words('english')
-except:
-    nltk.download('stopwords')
+# spaCy, pandas y NLTK se importan de forma diferida (en el primer uso) para que
+# importar este módulo sea barato. Los recursos se buscan solo en la instalación
+# local: nunca se intenta descargar nada desde la red.
+
+
+def verificar_recurso_nltk(ruta, nombre):
+    """Comprueba en la caché local de NLTK que un recurso esté instalado"""
+    import nltk
+
+    try:
+        nltk.data.find(ruta)
+    except LookupError:
+        raise LookupError(
+            f"Recurso de NLTK '{nombre}' no encontrado. "
+            f"Instálalo con: python -m nltk.downloader {nombre}"
+        ) from None
+
+
+@lru_cache(maxsize=None)
+def cargar_stopwords(idioma):
+    """Carga (una sola vez por proceso) las stopwords de NLTK de un idioma"""
+    verificar_recurso_nltk('corpora/stopwords', 'stopwords')
+    from nltk.corpus import stopwords as nltk_stopwords
+
+    return frozenset(nltk_stopwords.words(idioma))
+
+
+@lru_cache(maxsize=None)
+def cargar_modelo_spacy(nombre="es_core_news_sm"):
+    """Carga (una sola vez por proceso) un modelo de spaCy ya instalado"""
+    import spacy
+
+    try:
+        return spacy.load(nombre)
+    except OSError:
+        raise OSError(
+            f"Modelo de spaCy '{nombre}' no encontrado. "
+            f"Instálalo con: python -m spacy download {nombre}"
+        ) from None
+
+
+# Componentes del pipeline que necesita el reconocimiento de entidades
+COMPONENTES_NER = ('tok2vec', 'ner')
+
+# Tamaño máximo de cada fragmento que se pasa a spaCy (su max_length es 1.000.000
+# y necesita ~1GB de memoria temporal por cada 100.000 caracteres)
+MAX_CARACTERES_FRAGMENTO = 100_000
+
+# Posiciones tras un signo de fin de oración seguido de un espacio
+FIN_ORACION = re.compile(r'(?<=[.!?]\s)')
+
+
+def iterar_lineas(texto):
+    """Recorre las líneas de un texto (con su salto de línea) sin crear una lista"""
+    inicio = 0
+    while inicio < len(texto):
+        fin = texto.find('\n', inicio) + 1 or len(texto)
+        yield texto[inicio:fin]
+        inicio = fin
+
+
+def agrupar_parrafos(lineas, max_caracteres):
+    """Agrupa líneas en párrafos (separados por líneas en blanco) de tamaño acotado"""
+    parrafo, tamano = [], 0
+    for linea in lineas:
+        parrafo.append(linea)
+        tamano += len(linea)
+        if not linea.strip() or tamano >= max_caracteres:
+            yield ''.join(parrafo)
+            parrafo, tamano = [], 0
+    if parrafo:
+        yield ''.join(parrafo)
+
+
+def partir_parrafo(parrafo, max_caracteres):
+    """Parte un párrafo demasiado largo por oraciones y, en último caso, por espacios"""
+    if len(parrafo) <= max_caracteres:
+        yield parrafo
+        return
+
+    for oracion in FIN_ORACION.split(parrafo):
+        while len(oracion) > max_caracteres:
+            corte = oracion.rfind(' ', 0, max_caracteres) + 1 or max_caracteres
+            yield oracion[:corte]
+            oracion = oracion[corte:]
+        if oracion:
+            yield oracion
+
+
+def generar_ngramas(tokens, n):
+    """Genera n-gramas como tuplas (equivalente a nltk.util.ngrams)"""
+    return zip(*(tokens[i:] for i in range(n)))
 
 
 class ProcesadorAvanzado:
     def __init__(self):
-        self.nlp = spacy.load("es_core_news_sm")
-        self.stopwords_es = set(nltk_stopwords.words('spanish'))
-        self.stopwords_en = set(nltk_stopwords.words('english'))
-        self.stopwords = self.stopwords_es.union(self.stopwords_en)
+        self._nlp = None
+        self._stopwords = None
+        self.max_caracteres_fragmento = MAX_CARACTERES_FRAGMENTO
+
+    @property
+    def nlp(self):
+        if self._nlp is None:
+            self._nlp = cargar_modelo_spacy()
+        return self._nlp
+
+    @property
+    def stopwords_es(self):
+        return cargar_stopwords('spanish')
+
+    @property
+    def stopwords_en(self):
+        return cargar_stopwords('english')
+
+    @property
+    def stopwords(self):
+        if self._stopwords is None:
+            self._stopwords = self.stopwords_es | self.stopwords_en
+        return self._stopwords
 
     def extraer_emails(self, texto):
         patron = r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b'
         return re.findall(patron, texto)
 
     def limpiar_y_lematizar(self, texto):
+        # Los textos largos se procesan por fragmentos para no superar nlp.max_length
+        if len(texto) > self.max_caracteres_fragmento:
+            tokens_lematizados, emails = [], []
+            for tokens_fragmento, emails_fragmento in self.limpiar_y_lematizar_por_fragmentos(texto):
+                tokens_lematizados.extend(tokens_fragmento)
+                emails.extend(emails_fragmento)
+            return tokens_lematizados, emails
+
         # Extraer emails primero y preservarlos
         emails = self.extraer_emails(texto)
 
@@ -36,21 +145,67 @@ class ProcesadorAvanzado:
         doc = self.nlp(texto_sin_emails.lower())
 
         # Lematizar y filtrar
+        stopwords = self.stopwords
         tokens_lematizados = []
         for token in doc:
             if (token.is_alpha and
                     not token.is_stop and
-                    token.text not in self.stopwords and
+                    token.text not in stopwords and
                     len(token.text) > 2):
                 tokens_lematizados.append(token.lemma_)
 
         return tokens_lematizados, emails
 
+    def dividir_en_fragmentos(self, fuente, max_caracteres=None):
+        """Divide un texto (o un iterable de líneas) en fragmentos alineados a párrafos u oraciones"""
+        max_caracteres = max_caracteres or self.max_caracteres_fragmento
+
+        if isinstance(fuente, str):
+            if len(fuente) <= max_caracteres:
+                if fuente:
+                    yield fuente
+                return
+            fuente = iterar_lineas(fuente)
+
+        fragmento, tamano = [], 0
+        for parrafo in agrupar_parrafos(fuente, max_caracteres):
+            for pieza in partir_parrafo(parrafo, max_caracteres):
+                if fragmento and tamano + len(pieza) > max_caracteres:
+                    yield ''.join(fragmento)
+                    fragmento, tamano = [], 0
+                fragmento.append(pieza)
+                tamano += len(pieza)
+
+        if fragmento:
+            yield ''.join(fragmento)
+
+    def limpiar_y_lematizar_por_fragmentos(self, fuente, max_caracteres=None):
+        """Genera (tokens, emails) por fragmento, con un solo Doc de spaCy en memoria a la vez"""
+        for fragmento in self.dividir_en_fragmentos(fuente, max_caracteres):
+            yield self.limpiar_y_lematizar(fragmento)
+
+    def reconocer_entidades(self, texto):
+        doc = self.nlp(texto)
+        return [(ent.text, ent.label_) for ent in doc.ents]
+
+    def reconocer_entidades_lote(self, textos, batch_size=64, as_tuples=False):
+        """Reconoce entidades en varios textos con nlp.pipe, usando solo los componentes del NER.
+        Con as_tuples=True recibe pares (texto, contexto) y genera pares (entidades, contexto)."""
+        desactivar = [nombre for nombre in self.nlp.pipe_names if nombre not in COMPONENTES_NER]
+        docs = self.nlp.pipe(textos, batch_size=batch_size, disable=desactivar, as_tuples=as_tuples)
+
+        if as_tuples:
+            for doc, contexto in docs:
+                yield [(ent.text, ent.label_) for ent in doc.ents], contexto
+        else:
+            for doc in docs:
+                yield [(ent.text, ent.label_) for ent in doc.ents]
+
     def generar_bigramas(self, tokens):
-        return ['_'.join(bg) for bg in ngrams(tokens, 2)]
+        return ['_'.join(bg) for bg in generar_ngramas(tokens, 2)]
 
     def generar_trigramas(self, tokens):
-        return ['_'.join(tg) for tg in ngrams(tokens, 3)]
+        return ['_'.join(tg) for tg in generar_ngramas(tokens, 3)]
 
 
 class ModeloEspacioVectorial:
@@ -76,6 +231,8 @@ class ModeloEspacioVectorial:
         return tf_normalizado
 
     def construir_matriz(self):
+        import pandas as pd
+
         if not self.documentos:
             return pd.DataFrame()
 
@@ -1,29 +1,160 @@
-import pandas as pd
-from collections import Counter
+from array import array
+from collections import Counter, OrderedDict
+import hashlib
+import heapq
 import math
+import os
 
 from src.format_py.cp1.ejer4 import ProcesadorAvanzado
 
 
+def contar_frecuencias(tokens):
+    """Devuelve las frecuencias brutas de un documento (lista de tokens o Counter)"""
+    return tokens if isinstance(tokens, Counter) else Counter(tokens)
+
+
+class SketchCountMin:
+    """Count-Min sketch: estima frecuencias en memoria fija.
+    La estimación nunca es menor que el valor real y, con probabilidad 1 - delta,
+    no lo supera en más de epsilon × total."""
+
+    def __init__(self, epsilon=0.001, delta=0.01):
+        self.epsilon = epsilon
+        self.delta = delta
+        self.ancho = math.ceil(math.e / epsilon)
+        self.profundidad = math.ceil(math.log(1 / delta))
+        self.filas = [array('Q', bytes(8 * self.ancho)) for _ in range(self.profundidad)]
+        self.total = 0
+
+    def _posiciones(self, elemento):
+        # Doble hashing: h1 + i × h2 da una función hash distinta por fila
+        digest = hashlib.blake2b(elemento.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.ancho for i in range(self.profundidad)]
+
+    def agregar(self, elemento, cantidad=1):
+        """Suma `cantidad` al elemento (actualización conservadora) y devuelve la nueva estimación"""
+        posiciones = self._posiciones(elemento)
+        estimacion = min(fila[pos] for fila, pos in zip(self.filas, posiciones)) + cantidad
+        for fila, pos in zip(self.filas, posiciones):
+            if fila[pos] < estimacion:
+                fila[pos] = estimacion
+        self.total += cantidad
+        return estimacion
+
+    def estimar(self, elemento):
+        """Devuelve la frecuencia estimada de un elemento"""
+        return min(fila[pos] for fila, pos in zip(self.filas, self._posiciones(elemento)))
+
+
+class TerminosFrecuentes:
+    """Conserva los `capacidad` elementos con mayor frecuencia estimada (heavy hitters)"""
+
+    def __init__(self, capacidad=100):
+        self.capacidad = capacidad
+        self.conteos = {}
+        self._heap = []  # min-heap (conteo, elemento); puede contener entradas obsoletas
+
+    def actualizar(self, elemento, estimacion):
+        """Registra la estimación actual de un elemento, expulsando al menor si no cabe"""
+        if elemento not in self.conteos and len(self.conteos) >= self.capacidad:
+            # Descartar entradas obsoletas de la cima antes de comparar
+            while self._heap and self.conteos.get(self._heap[0][1]) != self._heap[0][0]:
+                heapq.heappop(self._heap)
+            if not self._heap or estimacion <= self._heap[0][0]:
+                return
+            _, expulsado = heapq.heappop(self._heap)
+            del self.conteos[expulsado]
+
+        self.conteos[elemento] = estimacion
+        heapq.heappush(self._heap, (estimacion, elemento))
+
+        if len(self._heap) > 4 * self.capacidad:
+            self._heap = [(conteo, e) for e, conteo in self.conteos.items()]
+            heapq.heapify(self._heap)
+
+    def mas_frecuentes(self, n=None):
+        """Devuelve [(elemento, conteo)] ordenados de mayor a menor"""
+        return sorted(self.conteos.items(), key=lambda par: par[1], reverse=True)[:n]
+
+
 class ModeloEspacioVectorialTFIDF:
-    def __init__(self):
+    def __init__(self, k1=1.2, b=0.75, df_aproximado=False, epsilon=0.001, delta=0.01,
+                 capacidad_frecuentes=100):
         self.documentos = {}
         self.matriz_tf = None
         self.matriz_tfidf = None
-        self.terminos = set()
         self.nombres_docs = []
         self.idf = {}
+        self.version = 0  # Cambia con cada documento añadido (invalida cachés externas)
+
+        # Frecuencia documental df(t): exacta (un contador por término) o aproximada
+        # con un Count-Min sketch de memoria fija más una lista de términos frecuentes.
+        # En modo aproximado no se guarda ninguna estructura con una entrada por término:
+        # ni el vocabulario (terminos) ni el idf completo, que se calcula bajo demanda.
+        self.df_aproximado = df_aproximado
+        if df_aproximado:
+            self.terminos = None
+            self.df = None
+            self.sketch_df = SketchCountMin(epsilon, delta)
+            self.frecuentes_df = TerminosFrecuentes(capacidad_frecuentes)
+        else:
+            self.terminos = set()
+            self.df = Counter()
+            self.sketch_df = None
+            self.frecuentes_df = None
+
+        # Parámetros y estructuras de BM25
+        self.k1 = k1
+        self.b = b
+        self.longitudes = {}
+        self.pesos_bm25 = None  # {doc: {termino: peso}}
+        self.postings_bm25 = None  # {termino: [(peso, doc), ...]} ordenados por impacto
+        self.cotas_bm25 = {}  # {termino: peso máximo en sus postings}
+        self.matriz_bm25 = None
 
     def agregar_documento(self, nombre, tokens):
-        """Añade un documento a la colección"""
+        """Añade un documento a la colección (lista de tokens o Counter de frecuencias).
+        Si ya existe un documento con ese nombre, lo reemplaza."""
+        if nombre in self.documentos:
+            if self.df_aproximado:
+                # El sketch (con actualización conservadora) no permite restar frecuencias
+                raise ValueError(f"El documento '{nombre}' ya existe: el modo df aproximado no admite reemplazos")
+
+            # Retirar la contribución del documento anterior a df(t) y al vocabulario
+            for termino in contar_frecuencias(self.documentos[nombre]).keys():
+                self.df[termino] -= 1
+                if self.df[termino] <= 0:
+                    del self.df[termino]
+                    self.terminos.discard(termino)
+        else:
+            self.nombres_docs.append(nombre)
+
         self.documentos[nombre] = tokens
-        self.terminos.update(tokens)
-        self.nombres_docs.append(nombre)
+        self.version += 1
+
+        frecuencias = contar_frecuencias(tokens)
+        self.longitudes[nombre] = sum(frecuencias.values())
+
+        distintos = frecuencias.keys()
+        if self.df_aproximado:
+            for termino in distintos:
+                self.frecuentes_df.actualizar(termino, self.sketch_df.agregar(termino))
+        else:
+            self.terminos.update(distintos)
+            self.df.update(distintos)
+
+        # Los pesos BM25 dependen de idf y de la longitud media de toda la colección:
+        # se recalculan en la próxima consulta (las longitudes ya están al día)
+        self.pesos_bm25 = None
+        self.postings_bm25 = None
+        self.matriz_bm25 = None
 
     def calcular_tf(self, tokens):
         """Calcula frecuencias normalizadas para un documento"""
-        total_terminos = len(tokens)
-        frecuencias = Counter(tokens)
+        frecuencias = contar_frecuencias(tokens)
+        total_terminos = sum(frecuencias.values())
 
         tf_normalizado = {}
         for termino, freq in frecuencias.items():
@@ -31,19 +162,47 @@ class ModeloEspacioVectorialTFIDF:
 
         return tf_normalizado
 
-    def calcular_idf(self):
-        """Calcula IDF para todos los términos usando la fórmula suavizada"""
+    def frecuencia_documental(self, termino):
+        """Devuelve df(t), exacta o estimada con el sketch según el modo"""
+        # Ningún término puede aparecer en más documentos de los que hay
+        if self.df_aproximado:
+            return min(self.sketch_df.estimar(termino), len(self.documentos))
+        return min(self.df[termino], len(self.documentos))
+
+    def obtener_terminos_frecuentes(self, n=10):
+        """Devuelve los n términos con mayor df como [(termino, df)]"""
+        if self.df_aproximado:
+            N = len(self.documentos)
+            return [(termino, min(df_t, N)) for termino, df_t in self.frecuentes_df.mas_frecuentes(n)]
+        return self.df.most_common(n)
+
+    def obtener_vocabulario(self):
+        """Devuelve los términos de la colección ordenados (en modo aproximado se recorren los documentos)"""
+        if self.terminos is not None:
+            return sorted(self.terminos)
+        vocabulario = set()
+        for tokens in self.documentos.values():
+            vocabulario.update(contar_frecuencias(tokens).keys())
+        return sorted(vocabulario)
+
+    def idf_termino(self, termino):
+        """Calcula el IDF suavizado de un término: log(N / (df(t) + 1)) + 1"""
         N = len(self.documentos)  # Número total de documentos
+        return math.log(N / (self.frecuencia_documental(termino) + 1)) + 1
 
-        for termino in self.terminos:
-            # df(t): número de documentos que contienen el término t
-            df_t = sum(1 for doc_tokens in self.documentos.values() if termino in doc_tokens)
+    def calcular_idf(self):
+        """Calcula IDF usando la fórmula suavizada (en modo aproximado, solo de los términos frecuentes)"""
+        if self.df_aproximado:
+            terminos = [termino for termino, _ in self.frecuentes_df.mas_frecuentes()]
+        else:
+            terminos = self.terminos
 
-            # idf(t) = log(N / (df(t) + 1)) + 1 (suavizado)
-            self.idf[termino] = math.log(N / (df_t + 1)) + 1
+        self.idf = {termino: self.idf_termino(termino) for termino in terminos}
 
     def construir_matriz_tf(self):
         """Construye la matriz término-documento con TF normalizado"""
+        import pandas as pd
+
         if not self.documentos:
             return pd.DataFrame()
 
@@ -60,23 +219,132 @@ class ModeloEspacioVectorialTFIDF:
 
     def construir_matriz_tfidf(self):
         """Construye la matriz TF-IDF"""
-        if self.matriz_tf is None:
-            self.construir_matriz_tf()
+        import pandas as pd
+
+        if not self.documentos:
+            return pd.DataFrame()
 
         self.calcular_idf()
 
-        # Crear matriz TF-IDF: tf-idf(d,t) = tf(d,t) × idf(t)
-        self.matriz_tfidf = self.matriz_tf.copy()
+        # Crear matriz TF-IDF: tf-idf(d,t) = tf(d,t) × idf(t), a partir de las frecuencias
+        # de cada documento (no hace falta recorrer el vocabulario completo)
+        matriz_data = {}
+        for doc_name, tokens in self.documentos.items():
+            matriz_data[doc_name] = {
+                termino: tf * self.idf_termino(termino)
+                for termino, tf in self.calcular_tf(tokens).items()
+            }
 
-        for termino in self.matriz_tfidf.index:
-            if termino in self.idf:
-                self.matriz_tfidf.loc[termino] = self.matriz_tfidf.loc[termino] * self.idf[termino]
+        self.matriz_tfidf = pd.DataFrame(matriz_data).fillna(0)
+        self.matriz_tfidf = self.matriz_tfidf[self.nombres_docs]
 
         return self.matriz_tfidf
 
-    def obtener_terminos_relevantes(self, doc_index, top_n=5, use_tfidf=True):
-        """Devuelve los n términos más importantes para un documento"""
-        if use_tfidf:
+    def construir_indice_bm25(self):
+        """Precalcula pesos BM25 y postings ordenados por impacto con su cota superior"""
+        frecuencias = {doc_name: contar_frecuencias(tokens) for doc_name, tokens in self.documentos.items()}
+
+        N = len(frecuencias)
+        longitud_media = (sum(self.longitudes.values()) / N if N else 0) or 1
+
+        # bm25(d,t) = idf(t) × tf × (k1 + 1) / (tf + k1 × (1 - b + b × |d| / avgdl))
+        self.pesos_bm25 = {}
+        self.postings_bm25 = {}
+        for doc_name, freqs in frecuencias.items():
+            norma = self.k1 * (1 - self.b + self.b * self.longitudes[doc_name] / longitud_media)
+            pesos_doc = {}
+            for termino, tf in freqs.items():
+                df_t = self.frecuencia_documental(termino)
+                idf = math.log(1 + (N - df_t + 0.5) / (df_t + 0.5))
+                peso = idf * tf * (self.k1 + 1) / (tf + norma)
+                pesos_doc[termino] = peso
+                self.postings_bm25.setdefault(termino, []).append((peso, doc_name))
+            self.pesos_bm25[doc_name] = pesos_doc
+
+        for postings in self.postings_bm25.values():
+            postings.sort(reverse=True)
+        self.cotas_bm25 = {termino: postings[0][0] for termino, postings in self.postings_bm25.items()}
+
+        return self.postings_bm25
+
+    def construir_matriz_bm25(self):
+        """Construye la matriz término-documento con pesos BM25"""
+        import pandas as pd
+
+        if not self.documentos:
+            return pd.DataFrame()
+
+        if self.pesos_bm25 is None:
+            self.construir_indice_bm25()
+
+        self.matriz_bm25 = pd.DataFrame(self.pesos_bm25).fillna(0)
+        self.matriz_bm25 = self.matriz_bm25[self.nombres_docs]
+
+        return self.matriz_bm25
+
+    def buscar_bm25(self, terminos, top_k=10):
+        """Devuelve los top_k documentos de una consulta con BM25, con terminación temprana"""
+        import pandas as pd
+
+        if self.postings_bm25 is None:
+            self.construir_indice_bm25()
+
+        consulta = {termino for termino in terminos if termino in self.postings_bm25}
+
+        # Algoritmo de umbral sobre postings ordenados por impacto: se avanza en paralelo
+        # por las listas (de mayor a menor cota) y se para cuando ningún documento
+        # no visto puede superar al k-ésimo mejor.
+        listas = sorted(
+            ((self.cotas_bm25[t], self.postings_bm25[t]) for t in consulta),
+            key=lambda par: par[0],
+            reverse=True,
+        )
+        cota_no_esenciales = 0.0  # Suma de cotas de las listas que ya no se recorren
+        mejores = []  # min-heap de (puntuación, doc)
+        vistos = set()
+        profundidad = 0
+
+        while listas and top_k > 0:
+            umbral = cota_no_esenciales
+            for _, postings in listas:
+                peso, doc_name = postings[profundidad]
+                umbral += peso
+                if doc_name in vistos:
+                    continue
+                vistos.add(doc_name)
+
+                pesos_doc = self.pesos_bm25[doc_name]
+                puntuacion = sum(pesos_doc.get(t, 0.0) for t in consulta)
+                if len(mejores) < top_k:
+                    heapq.heappush(mejores, (puntuacion, doc_name))
+                elif puntuacion > mejores[0][0]:
+                    heapq.heapreplace(mejores, (puntuacion, doc_name))
+
+            if len(mejores) == top_k:
+                if mejores[0][0] >= umbral:
+                    break
+
+                # Poda estilo MaxScore: un documento que solo aparezca en las listas de menor
+                # cota no puede superar al k-ésimo mejor, así que esas listas dejan de recorrerse
+                # (sus pesos se siguen sumando por acceso directo a pesos_bm25)
+                while listas and cota_no_esenciales + listas[-1][0] <= mejores[0][0]:
+                    cota_no_esenciales += listas.pop()[0]
+
+            profundidad += 1
+            listas = [(cota, postings) for cota, postings in listas if profundidad < len(postings)]
+
+        return pd.Series(
+            {doc_name: puntuacion for puntuacion, doc_name in sorted(mejores, reverse=True)},
+            dtype=float,
+        )
+
+    def obtener_terminos_relevantes(self, doc_index, top_n=5, use_tfidf=True, use_bm25=False):
+        """Devuelve los n términos más importantes para un documento (use_bm25 tiene prioridad)"""
+        if use_bm25:
+            if self.matriz_bm25 is None:
+                self.construir_matriz_bm25()
+            matriz = self.matriz_bm25
+        elif use_tfidf:
             if self.matriz_tfidf is None:
                 self.construir_matriz_tfidf()
             matriz = self.matriz_tfidf
@@ -98,34 +366,393 @@ class ModeloEspacioVectorialTFIDF:
 
         return terminos_relevantes
 
+    def exportar_columnar(self, directorio, formato='arrow', top_n=5):
+        """Exporta TF, TF-IDF (COO), IDF y términos relevantes a Arrow IPC o Parquet"""
+        try:
+            import pyarrow as pa
+        except ImportError:
+            raise ImportError("La exportación columnar necesita pyarrow: pip install pyarrow") from None
+
+        if formato not in ('arrow', 'parquet'):
+            raise ValueError("Formato no soportado: usa 'arrow' o 'parquet'")
+
+        vocabulario = self.obtener_vocabulario()
+        ids_terminos = {termino: i for i, termino in enumerate(vocabulario)}
+        metadatos = {'terminos': str(len(vocabulario)), 'documentos': str(len(self.nombres_docs))}
+
+        # Matrices dispersas en formato COO (termino_id, doc_id, valor), sin pasar por la matriz densa
+        filas, columnas, valores_tf, valores_tfidf = [], [], [], []
+        top_doc, top_rango, top_termino, top_peso = [], [], [], []
+        for doc_id, doc_name in enumerate(self.nombres_docs):
+            tf_doc = self.calcular_tf(self.documentos[doc_name])
+            tfidf_doc = {termino: tf * self.idf_termino(termino) for termino, tf in tf_doc.items()}
+            for termino, tf in tf_doc.items():
+                filas.append(ids_terminos[termino])
+                columnas.append(doc_id)
+                valores_tf.append(tf)
+                valores_tfidf.append(tfidf_doc[termino])
+
+            mejores = heapq.nlargest(top_n, tfidf_doc.items(), key=lambda par: par[1])
+            for rango, (termino, peso) in enumerate(mejores, 1):
+                top_doc.append(doc_id)
+                top_rango.append(rango)
+                top_termino.append(ids_terminos[termino])
+                top_peso.append(peso)
+
+        filas = pa.array(filas, pa.int32())
+        columnas = pa.array(columnas, pa.int32())
+        tablas = {
+            'terminos': pa.table({'termino_id': pa.array(range(len(vocabulario)), pa.int32()),
+                                  'termino': pa.array(vocabulario, pa.string())}),
+            'documentos': pa.table({'doc_id': pa.array(range(len(self.nombres_docs)), pa.int32()),
+                                    'documento': pa.array(self.nombres_docs, pa.string())}),
+            'tf': pa.table({'termino_id': filas, 'doc_id': columnas,
+                            'valor': pa.array(valores_tf, pa.float64())}),
+            'tfidf': pa.table({'termino_id': filas, 'doc_id': columnas,
+                               'valor': pa.array(valores_tfidf, pa.float64())}),
+            'idf': pa.table({'termino_id': pa.array(range(len(vocabulario)), pa.int32()),
+                             'df': pa.array([self.frecuencia_documental(t) for t in vocabulario], pa.int64()),
+                             'idf': pa.array([self.idf_termino(t) for t in vocabulario], pa.float64())}),
+            'terminos_relevantes': pa.table({'doc_id': pa.array(top_doc, pa.int32()),
+                                             'rango': pa.array(top_rango, pa.int16()),
+                                             'termino_id': pa.array(top_termino, pa.int32()),
+                                             'peso_tfidf': pa.array(top_peso, pa.float64())}),
+        }
+
+        os.makedirs(directorio, exist_ok=True)
+        rutas = {}
+        for nombre, tabla in tablas.items():
+            tabla = tabla.replace_schema_metadata(metadatos)
+            ruta = os.path.join(directorio, f"{nombre}.{formato}")
+            if formato == 'parquet':
+                import pyarrow.parquet as pq
+                pq.write_table(tabla, ruta)
+            else:
+                # IPC sin compresión: los lectores pueden mapear el fichero sin copiar los buffers
+                with pa.OSFile(ruta, 'wb') as destino, pa.ipc.new_file(destino, tabla.schema) as escritor:
+                    escritor.write_table(tabla)
+            rutas[nombre] = ruta
+
+        return rutas
+
     def obtener_estadisticas_idf(self):
         """Devuelve estadísticas del cálculo IDF"""
+        import pandas as pd
+
         if not self.idf:
             self.calcular_idf()
 
         return pd.Series(self.idf).sort_values()
 
 
+def cargar_columnar(ruta):
+    """Carga una tabla exportada; los ficheros Arrow IPC se mapean en memoria sin copiarlos"""
+    import pyarrow as pa
+
+    if ruta.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        return pq.read_table(ruta, memory_map=True)
+
+    with pa.memory_map(ruta, 'r') as fuente:
+        return pa.ipc.open_file(fuente).read_all()
+
+
+def comparar_rankings(modelo_a, modelo_b, top_n=5):
+    """Devuelve la coincidencia media (0-1) entre los top_n términos TF-IDF de ambos modelos"""
+    coincidencias = []
+    for i in range(len(modelo_a.nombres_docs)):
+        top_a = set(modelo_a.obtener_terminos_relevantes(i, top_n).index)
+        top_b = set(modelo_b.obtener_terminos_relevantes(i, top_n).index)
+        coincidencias.append(len(top_a & top_b) / max(len(top_a), 1))
+    return sum(coincidencias) / len(coincidencias) if coincidencias else 1.0
+
+
+def codificar_posiciones(posiciones, anterior=0):
+    """Codifica posiciones crecientes como deltas en variable-byte"""
+    # 7 bits de datos por byte; el bit alto marca el último byte de cada número
+    salida = bytearray()
+    for posicion in posiciones:
+        delta = posicion - anterior
+        anterior = posicion
+        while delta >= 0x80:
+            salida.append(delta & 0x7F)
+            delta >>= 7
+        salida.append(delta | 0x80)
+    return salida
+
+
+def decodificar_posiciones(datos):
+    """Decodifica una secuencia delta + variable-byte en la lista de posiciones absolutas"""
+    posiciones = []
+    actual = valor = desplazamiento = 0
+    for byte in datos:
+        if byte & 0x80:
+            actual += valor | ((byte & 0x7F) << desplazamiento)
+            posiciones.append(actual)
+            valor = desplazamiento = 0
+        else:
+            valor |= byte << desplazamiento
+            desplazamiento += 7
+    return posiciones
+
+
+class IndicePosicional:
+    """Índice invertido posicional: término → {documento: posiciones comprimidas}.
+    Las posiciones cuentan los tokens lematizados (sin stopwords), igual que los bigramas."""
+
+    def __init__(self):
+        self.postings = {}  # {termino: {doc: [última posición, bytearray]}}
+        self.longitudes = {}  # {doc: número de tokens indexados}
+
+    def agregar(self, nombre_doc, tokens):
+        """Añade tokens al documento, a continuación de los ya indexados (admite fragmentos)"""
+        inicio = self.longitudes.get(nombre_doc, 0)
+        posiciones = {}
+        for posicion, termino in enumerate(tokens, inicio):
+            posiciones.setdefault(termino, []).append(posicion)
+
+        for termino, lista in posiciones.items():
+            entrada = self.postings.setdefault(termino, {}).setdefault(nombre_doc, [0, bytearray()])
+            entrada[1] += codificar_posiciones(lista, entrada[0])
+            entrada[0] = lista[-1]
+
+        self.longitudes[nombre_doc] = inicio + len(tokens)
+
+    def eliminar(self, nombre_doc):
+        """Quita un documento de todas las postings (para reemplazarlo)"""
+        for termino in list(self.postings):
+            por_doc = self.postings[termino]
+            if por_doc.pop(nombre_doc, None) is not None and not por_doc:
+                del self.postings[termino]
+        self.longitudes.pop(nombre_doc, None)
+
+    def posiciones(self, termino, nombre_doc):
+        """Devuelve las posiciones de un término en un documento"""
+        entrada = self.postings.get(termino, {}).get(nombre_doc)
+        return decodificar_posiciones(entrada[1]) if entrada else []
+
+    def _documentos_comunes(self, terminos):
+        # Intersección de postings empezando por el término con menos documentos
+        listas = sorted((self.postings.get(t, {}) for t in terminos), key=len)
+        if not listas or not listas[0]:
+            return set()
+        comunes = set(listas[0])
+        for postings in listas[1:]:
+            comunes.intersection_update(postings)
+        return comunes
+
+    def buscar_frase(self, terminos):
+        """Devuelve {documento: posiciones de inicio} donde aparecen los términos consecutivos"""
+        resultado = {}
+        for nombre_doc in self._documentos_comunes(terminos):
+            inicios = set(self.posiciones(terminos[0], nombre_doc))
+            for desplazamiento, termino in enumerate(terminos[1:], 1):
+                inicios.intersection_update(p - desplazamiento for p in self.posiciones(termino, nombre_doc))
+                if not inicios:
+                    break
+            if inicios:
+                resultado[nombre_doc] = sorted(inicios)
+        return resultado
+
+    def buscar_cercania(self, terminos, k):
+        """Devuelve {documento: [(inicio, fin)]} con ventanas que contienen todos los términos
+        a distancia ≤ k (fin - inicio ≤ k, es decir, como mucho k + 1 tokens)"""
+        terminos = list(dict.fromkeys(terminos))
+        resultado = {}
+        for nombre_doc in self._documentos_comunes(terminos):
+            listas = [self.posiciones(t, nombre_doc) for t in terminos]
+            punteros = [0] * len(listas)
+            ventanas = []
+            # Para cada posible inicio se toma la ventana mínima y se avanza el término más atrasado
+            while True:
+                actuales = [lista[i] for lista, i in zip(listas, punteros)]
+                inicio, fin = min(actuales), max(actuales)
+                if fin - inicio <= k:
+                    ventanas.append((inicio, fin))
+                atrasado = actuales.index(inicio)
+                punteros[atrasado] += 1
+                if punteros[atrasado] == len(listas[atrasado]):
+                    break
+            if ventanas:
+                resultado[nombre_doc] = ventanas
+        return resultado
+
+
+# Marca para distinguir "no está en caché" de un valor guardado
+_AUSENTE = object()
+
+
+class CacheLRU:
+    """Caché de tamaño limitado que expulsa la entrada usada hace más tiempo"""
+
+    def __init__(self, capacidad=1024):
+        self.capacidad = capacidad
+        self.datos = OrderedDict()
+        self.aciertos = 0
+        self.fallos = 0
+
+    def obtener(self, clave, por_defecto=None):
+        if clave in self.datos:
+            self.datos.move_to_end(clave)
+            self.aciertos += 1
+            return self.datos[clave]
+        self.fallos += 1
+        return por_defecto
+
+    def guardar(self, clave, valor):
+        self.datos[clave] = valor
+        self.datos.move_to_end(clave)
+        if len(self.datos) > self.capacidad:
+            self.datos.popitem(last=False)
+
+    def limpiar(self):
+        self.datos.clear()
+
+    def tasa_aciertos(self):
+        total = self.aciertos + self.fallos
+        return self.aciertos / total if total else 0.0
+
+
+class CacheConsultas:
+    """Caché de dos niveles: texto de consulta → términos normalizados, y términos → resultados top-k"""
+
+    def __init__(self, capacidad_terminos=4096, capacidad_resultados=1024):
+        self.terminos = CacheLRU(capacidad_terminos)
+        self.resultados = CacheLRU(capacidad_resultados)
+        self.version_indice = None
+        self.invalidaciones = 0
+
+    def obtener_terminos(self, consulta, normalizar):
+        """Devuelve los términos normalizados de una consulta, llamando a normalizar solo si no están"""
+        clave = ' '.join(consulta.split())
+        terminos = self.terminos.obtener(clave, _AUSENTE)
+        if terminos is _AUSENTE:
+            terminos = tuple(normalizar(clave))
+            self.terminos.guardar(clave, terminos)
+        return terminos
+
+    def obtener_resultados(self, terminos, top_k, version_indice, buscar):
+        """Devuelve los resultados de unos términos, descartando todo si el índice cambió de versión"""
+        if version_indice != self.version_indice:
+            if self.version_indice is not None:
+                self.invalidaciones += 1
+            self.resultados.limpiar()
+            self.version_indice = version_indice
+
+        clave = (frozenset(terminos), top_k)
+        resultados = self.resultados.obtener(clave, _AUSENTE)
+        if resultados is _AUSENTE:
+            resultados = buscar(terminos, top_k)
+            self.resultados.guardar(clave, resultados)
+        return resultados.copy()
+
+    def estadisticas(self):
+        """Devuelve tamaño, aciertos, fallos y tasa de aciertos de cada nivel"""
+        return {
+            nombre: {
+                'entradas': len(cache.datos),
+                'capacidad': cache.capacidad,
+                'aciertos': cache.aciertos,
+                'fallos': cache.fallos,
+                'tasa_aciertos': cache.tasa_aciertos(),
+            }
+            for nombre, cache in (('terminos', self.terminos), ('resultados', self.resultados))
+        } | {'invalidaciones': self.invalidaciones}
+
+
+class IndiceEntidades:
+    """Índice invertido de entidades: entidad normalizada → etiqueta → {documento: apariciones}"""
+
+    def __init__(self):
+        self.indice = {}
+
+    @staticmethod
+    def normalizar(entidad):
+        """Normaliza una entidad: minúsculas y espacios colapsados"""
+        return ' '.join(entidad.lower().split())
+
+    def agregar(self, nombre_doc, entidades):
+        """Añade al índice las entidades (texto, etiqueta) reconocidas en un documento"""
+        for texto, etiqueta in entidades:
+            postings = self.indice.setdefault(self.normalizar(texto), {}).setdefault(etiqueta, {})
+            postings[nombre_doc] = postings.get(nombre_doc, 0) + 1
+
+    def eliminar(self, nombre_doc):
+        """Quita un documento de todas las postings (para reemplazarlo)"""
+        for entidad in list(self.indice):
+            por_etiqueta = self.indice[entidad]
+            for etiqueta in list(por_etiqueta):
+                postings = por_etiqueta[etiqueta]
+                if postings.pop(nombre_doc, None) is not None and not postings:
+                    del por_etiqueta[etiqueta]
+            if not por_etiqueta:
+                del self.indice[entidad]
+
+    def buscar(self, entidad, etiqueta=None):
+        """Devuelve {documento: apariciones} para una entidad, opcionalmente filtrando por etiqueta"""
+        por_etiqueta = self.indice.get(self.normalizar(entidad), {})
+        if etiqueta is not None:
+            return dict(por_etiqueta.get(etiqueta, {}))
+
+        resultado = {}
+        for postings in por_etiqueta.values():
+            for doc_name, apariciones in postings.items():
+                resultado[doc_name] = resultado.get(doc_name, 0) + apariciones
+        return resultado
+
+    def facetas(self, entidad):
+        """Devuelve {etiqueta: apariciones totales} para una entidad"""
+        por_etiqueta = self.indice.get(self.normalizar(entidad), {})
+        return {etiqueta: sum(postings.values()) for etiqueta, postings in por_etiqueta.items()}
+
+    def entidades_con_etiqueta(self, etiqueta):
+        """Devuelve las entidades indexadas con una etiqueta (PER, ORG, LOC, MISC...)"""
+        return sorted(entidad for entidad, por_etiqueta in self.indice.items() if etiqueta in por_etiqueta)
+
+
 # Sistema extendido con TF-IDF
 class SistemaProcesamientoTextoAvanzado:
-    def __init__(self):
+    def __init__(self, usar_bigramas=True):
+        self.usar_bigramas = usar_bigramas
         self.procesador = ProcesadorAvanzado()
         self.modelo = ModeloEspacioVectorialTFIDF()
         self.documentos_originales = {}
         self.emails_por_documento = {}
+        self.indice_entidades = IndiceEntidades()
+        self._pendientes_ner = []
+        self.cache_consultas = CacheConsultas()
+        self.indice_posicional = IndicePosicional()
+
+    def _retirar_documento(self, nombre):
+        # Un nombre repetido reemplaza al documento: se quitan sus datos de los índices
+        if nombre not in self.modelo.documentos:
+            return
+        if self.modelo.df_aproximado:
+            raise ValueError(f"El documento '{nombre}' ya existe: el modo df aproximado no admite reemplazos")
+        self.indice_posicional.eliminar(nombre)
+        self.indice_entidades.eliminar(nombre)
+        self.documentos_originales.pop(nombre, None)
+        if nombre in self._pendientes_ner:
+            self._pendientes_ner.remove(nombre)
 
     def agregar_documento(self, nombre, texto):
-        """Agrega un documento al sistema"""
+        """Agrega un documento al sistema (si el nombre ya existe, lo reemplaza)"""
+        if len(texto) > self.procesador.max_caracteres_fragmento:
+            return self.agregar_documento_largo(nombre, texto)
+
+        self._retirar_documento(nombre)
         self.documentos_originales[nombre] = texto
 
         # Procesar el texto
         tokens_lematizados, emails = self.procesador.limpiar_y_lematizar(texto)
 
-        # Generar bigramas
-        bigramas = self.procesador.generar_bigramas(tokens_lematizados)
+        # Registrar posiciones para consultas de frase y cercanía
+        self.indice_posicional.agregar(nombre, tokens_lematizados)
 
-        # Combinar tokens simples y bigramas
-        tokens_completos = tokens_lematizados + bigramas
+        # Combinar tokens simples y bigramas (opcionales: las frases las resuelve el índice posicional)
+        tokens_completos = list(tokens_lematizados)
+        if self.usar_bigramas:
+            tokens_completos.extend(self.procesador.generar_bigramas(tokens_lematizados))
 
         # Agregar emails como términos especiales
         tokens_completos.extend(emails)
@@ -133,9 +760,103 @@ class SistemaProcesamientoTextoAvanzado:
         # Guardar emails para reporte
         self.emails_por_documento[nombre] = emails
 
+        # El NER se ejecuta en lote la próxima vez que se consulte el índice de entidades
+        self._pendientes_ner.append(nombre)
+
         # Agregar al modelo vectorial
         self.modelo.agregar_documento(nombre, tokens_completos)
 
+    def agregar_documento_largo(self, nombre, fuente, max_caracteres=None):
+        """Agrega un documento procesándolo por fragmentos y acumulando frecuencias.
+        Si fuente es un iterable de líneas, el texto no se guarda y el NER se hace en la misma pasada."""
+        self._retirar_documento(nombre)
+        en_streaming = not isinstance(fuente, str)
+        if not en_streaming:
+            self.documentos_originales[nombre] = fuente
+            self._pendientes_ner.append(nombre)
+
+        frecuencias = Counter()
+        emails_documento = []
+        cola = []  # Último token del fragmento anterior, para bigramas entre fragmentos
+
+        for fragmento in self.procesador.dividir_en_fragmentos(fuente, max_caracteres):
+            tokens, emails = self.procesador.limpiar_y_lematizar(fragmento)
+            if en_streaming:
+                for entidades in self.procesador.reconocer_entidades_lote([fragmento], batch_size=1):
+                    self.indice_entidades.agregar(nombre, entidades)
+
+            ventana = cola + tokens
+            self.indice_posicional.agregar(nombre, tokens)
+            frecuencias.update(tokens)
+            if self.usar_bigramas:
+                frecuencias.update(self.procesador.generar_bigramas(ventana))
+            frecuencias.update(emails)
+            emails_documento.extend(emails)
+            cola = ventana[-1:]
+
+        self.emails_por_documento[nombre] = emails_documento
+        self.modelo.agregar_documento(nombre, frecuencias)
+
+    def exportar_reporte(self, directorio, formato='arrow', top_n=5):
+        """Exporta las matrices del sistema en formato columnar para análisis posteriores"""
+        return self.modelo.exportar_columnar(directorio, formato, top_n)
+
+    def normalizar_consulta(self, consulta):
+        """Convierte una consulta en texto libre en los mismos términos que indexa el modelo"""
+        tokens_lematizados, emails = self.procesador.limpiar_y_lematizar(consulta)
+        terminos = list(tokens_lematizados)
+        if self.usar_bigramas:
+            terminos.extend(self.procesador.generar_bigramas(tokens_lematizados))
+        return terminos + emails
+
+    def buscar_frase(self, frase):
+        """Devuelve {documento: posiciones} donde aparece la frase exacta (tras lematizar)"""
+        terminos, _ = self.procesador.limpiar_y_lematizar(frase)
+        return self.indice_posicional.buscar_frase(terminos) if terminos else {}
+
+    def buscar_cercania(self, consulta, k=5):
+        """Devuelve {documento: ventanas} donde todos los términos aparecen a distancia ≤ k
+        (posición del último menos la del primero, contando solo tokens lematizados)"""
+        terminos, _ = self.procesador.limpiar_y_lematizar(consulta)
+        return self.indice_posicional.buscar_cercania(terminos, k) if terminos else {}
+
+    def buscar(self, consulta, top_k=5):
+        """Busca los documentos más relevantes para una consulta en texto libre (BM25, con caché)"""
+        terminos = self.cache_consultas.obtener_terminos(consulta, self.normalizar_consulta)
+        return self.cache_consultas.obtener_resultados(
+            terminos, top_k, self.modelo.version, self.modelo.buscar_bm25
+        )
+
+    def indexar_entidades(self, batch_size=64):
+        """Ejecuta el NER en lote sobre los documentos pendientes y actualiza el índice de entidades"""
+        nombres = list(self._pendientes_ner)
+
+        # Los documentos largos se pasan por fragmentos; el índice suma las apariciones
+        fragmentos = (
+            (fragmento, nombre)
+            for nombre in nombres
+            for fragmento in self.procesador.dividir_en_fragmentos(self.documentos_originales[nombre])
+        )
+        entidades_lote = self.procesador.reconocer_entidades_lote(fragmentos, batch_size=batch_size, as_tuples=True)
+
+        # El índice y la cola solo se actualizan si el NER termina: si falla (modelo ausente,
+        # error a mitad del lote) los documentos siguen pendientes y no quedan a medias
+        entidades_por_documento = {}
+        for entidades, nombre in entidades_lote:
+            entidades_por_documento.setdefault(nombre, []).extend(entidades)
+
+        for nombre in nombres:
+            self.indice_entidades.agregar(nombre, entidades_por_documento.get(nombre, []))
+        del self._pendientes_ner[:len(nombres)]
+
+        return self.indice_entidades
+
+    def buscar_entidad(self, entidad, etiqueta=None):
+        """Devuelve {documento: apariciones} de una entidad consultando el índice"""
+        if self._pendientes_ner:
+            self.indexar_entidades()
+        return self.indice_entidades.buscar(entidad, etiqueta)
+
     def generar_reporte_completo(self):
         """Genera el reporte completo con comparación TF vs TF-IDF"""
         print("=== SISTEMA AVANZADO DE PROCESAMIENTO DE TEXTO (TF-IDF) ===")
@@ -259,6 +980,36 @@ if __name__ == "__main__":
     # Generar reporte completo con TF-IDF
     reporte = sistema_avanzado.generar_reporte_completo()
 
+    # Búsqueda con BM25 (postings ordenados por impacto y terminación temprana)
+    print("\n" + "=" * 70)
+    print("BÚSQUEDA BM25:")
+    print("=" * 70)
+    for consulta in ["machine learning", "medicina preventiva", "educación online"]:
+        resultados = sistema_avanzado.buscar(consulta, top_k=2)
+        print(f"  '{consulta}': {resultados.round(4).to_dict()}")
+
+    # Las consultas repetidas se sirven desde la caché sin lematizar ni puntuar de nuevo
+    sistema_avanzado.buscar("machine   learning", top_k=2)
+    sistema_avanzado.buscar("machine learning", top_k=2)
+    print(f"  Caché de consultas: {sistema_avanzado.cache_consultas.estadisticas()}")
+
+    # Consultas de frase y cercanía con el índice posicional
+    print("\n" + "=" * 70)
+    print("CONSULTAS POSICIONALES:")
+    print("=" * 70)
+    print(f"  Frase 'machine learning': {sistema_avanzado.buscar_frase('machine learning')}")
+    print(f"  'machine' cerca de 'datos' (k=5): {sistema_avanzado.buscar_cercania('machine datos', k=5)}")
+
+    # Consultas sobre el índice de entidades (NER en lote, una sola vez)
+    print("\n" + "=" * 70)
+    print("CONSULTAS AL ÍNDICE DE ENTIDADES:")
+    print("=" * 70)
+    for entidad in ["Python", "Google España"]:
+        print(f"  '{entidad}': {sistema_avanzado.buscar_entidad(entidad) or 'Sin coincidencias'}")
+        facetas = sistema_avanzado.indice_entidades.facetas(entidad)
+        if facetas:
+            print(f"     Etiquetas: {facetas}")
+
     # Ejemplo de cálculo manual para demostración
     print("\n" + "=" * 70)
     print("DEMOSTRACIÓN DEL CÁLCULO TF-IDF:")
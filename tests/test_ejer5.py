@@ -0,0 +1,359 @@
+import random
+from collections import Counter
+
+import pytest
+
+pytest.importorskip("pandas")
+
+from src.format_py.cp1.ejer4 import ProcesadorAvanzado
+from src.format_py.cp1.ejer5 import (
+    CacheConsultas,
+    CacheLRU,
+    IndicePosicional,
+    ModeloEspacioVectorialTFIDF,
+    SistemaProcesamientoTextoAvanzado,
+    codificar_posiciones,
+    comparar_rankings,
+    decodificar_posiciones,
+)
+
+
+class ProcesadorSinSpacy(ProcesadorAvanzado):
+    """Procesador de prueba: lematiza separando por espacios y reconoce como entidad
+    cada palabra en mayúscula inicial, sin cargar spaCy"""
+
+    def limpiar_y_lematizar(self, texto):
+        emails = self.extraer_emails(texto)
+        tokens = [palabra.strip('.,;:!?').lower() for palabra in texto.split() if '@' not in palabra]
+        return [token for token in tokens if token], emails
+
+    def reconocer_entidades_lote(self, textos, batch_size=64, as_tuples=False):
+        for elemento in textos:
+            texto, contexto = elemento if as_tuples else (elemento, None)
+            entidades = [(palabra.strip('.,;:!?'), 'ORG') for palabra in texto.split() if palabra.istitle()]
+            yield (entidades, contexto) if as_tuples else entidades
+
+
+def crear_sistema(**opciones):
+    sistema = SistemaProcesamientoTextoAvanzado(**opciones)
+    sistema.procesador = ProcesadorSinSpacy()
+    return sistema
+
+
+def generar_corpus(documentos=200, vocabulario=5000, longitud=150, semilla=42):
+    """Corpus sintético con frecuencias tipo Zipf (sin spaCy)"""
+    aleatorio = random.Random(semilla)
+    terminos = [f"t{i}" for i in range(vocabulario)]
+    pesos = [1 / (i + 1) ** 1.1 for i in range(vocabulario)]
+    return {f"doc{i}": aleatorio.choices(terminos, weights=pesos, k=longitud) for i in range(documentos)}
+
+
+def construir_modelo(corpus, **opciones):
+    modelo = ModeloEspacioVectorialTFIDF(**opciones)
+    for nombre, tokens in corpus.items():
+        modelo.agregar_documento(nombre, tokens)
+    return modelo
+
+
+@pytest.fixture(scope="module")
+def corpus():
+    return generar_corpus()
+
+
+@pytest.fixture(scope="module")
+def modelo_exacto(corpus):
+    return construir_modelo(corpus)
+
+
+@pytest.mark.parametrize("epsilon, coincidencia_minima", [(0.002, 0.75), (0.0005, 0.95)])
+def test_sketch_conserva_ranking_top_n(corpus, modelo_exacto, epsilon, coincidencia_minima):
+    modelo_sketch = construir_modelo(corpus, df_aproximado=True, epsilon=epsilon)
+    assert comparar_rankings(modelo_exacto, modelo_sketch, top_n=10) >= coincidencia_minima
+
+
+def test_menor_epsilon_mejora_ranking(corpus, modelo_exacto):
+    grueso = construir_modelo(corpus, df_aproximado=True, epsilon=0.05)
+    fino = construir_modelo(corpus, df_aproximado=True, epsilon=0.0005)
+    assert comparar_rankings(modelo_exacto, fino, 10) > comparar_rankings(modelo_exacto, grueso, 10)
+
+
+def test_sketch_acota_df_entre_valor_exacto_y_n(corpus, modelo_exacto):
+    modelo_sketch = construir_modelo(corpus, df_aproximado=True, epsilon=0.01)
+    N = len(corpus)
+    for termino, df_t in modelo_exacto.df.items():
+        assert df_t <= modelo_sketch.frecuencia_documental(termino) <= N
+
+
+def test_sketch_no_guarda_estructuras_por_termino(corpus):
+    modelo_sketch = construir_modelo(corpus, df_aproximado=True, capacidad_frecuentes=50)
+    modelo_sketch.construir_matriz_tfidf()
+    assert modelo_sketch.terminos is None
+    assert modelo_sketch.df is None
+    assert len(modelo_sketch.idf) <= 50
+
+
+def test_terminos_frecuentes_acotados_por_n():
+    modelo = ModeloEspacioVectorialTFIDF(df_aproximado=True, epsilon=0.5)
+    for i in range(3):
+        modelo.agregar_documento(f"doc{i}", [f"t{j}" for j in range(20)])
+    assert all(df_t <= 3 for _, df_t in modelo.obtener_terminos_frecuentes(10))
+
+
+def test_reemplazar_documento_no_duplica_df():
+    modelo = ModeloEspacioVectorialTFIDF()
+    modelo.agregar_documento('a', ['x', 'y'])
+    modelo.agregar_documento('a', ['x', 'y'])
+    modelo.agregar_documento('b', ['z'])
+    modelo.calcular_idf()
+
+    assert modelo.nombres_docs == ['a', 'b']
+    assert modelo.frecuencia_documental('x') == 1
+    assert modelo.idf['x'] == pytest.approx(1.0)
+
+
+def test_reemplazar_documento_retira_terminos_huerfanos():
+    modelo = ModeloEspacioVectorialTFIDF()
+    modelo.agregar_documento('a', ['x', 'y'])
+    modelo.agregar_documento('a', ['y'])
+    assert 'x' not in modelo.terminos
+    assert modelo.frecuencia_documental('x') == 0
+
+
+def test_modo_aproximado_rechaza_reemplazos():
+    modelo = ModeloEspacioVectorialTFIDF(df_aproximado=True)
+    modelo.agregar_documento('a', ['x'])
+    with pytest.raises(ValueError):
+        modelo.agregar_documento('a', ['y'])
+
+
+def test_reemplazar_documento_actualiza_indice_posicional():
+    sistema = crear_sistema()
+    sistema.agregar_documento('a', 'Google gato perro casa')
+    sistema.agregar_documento('a', 'Google raton queso')
+
+    assert sistema.buscar_frase('gato perro') == {}
+    assert sistema.buscar_frase('raton queso') == {'a': [1]}
+    assert sistema.indice_posicional.longitudes == {'a': 3}
+    assert 'gato' not in sistema.indice_posicional.postings
+
+
+def test_reemplazar_documento_no_duplica_entidades():
+    sistema = crear_sistema()
+    sistema.agregar_documento('a', 'Google gato perro casa')
+    sistema.buscar_entidad('Google')
+    sistema.agregar_documento('a', 'Google raton queso')
+
+    assert sistema._pendientes_ner == ['a']
+    assert sistema.buscar_entidad('Google') == {'a': 1}
+
+
+class ProcesadorConNerRoto(ProcesadorSinSpacy):
+    def reconocer_entidades_lote(self, textos, batch_size=64, as_tuples=False):
+        raise OSError("Modelo de spaCy no disponible")
+        yield
+
+
+def test_fallo_del_ner_no_pierde_documentos_pendientes():
+    sistema = crear_sistema()
+    sistema.agregar_documento('a', 'Google gato')
+
+    procesador = sistema.procesador
+    sistema.procesador = ProcesadorConNerRoto()
+    with pytest.raises(OSError):
+        sistema.buscar_entidad('Google')
+    assert sistema._pendientes_ner == ['a']
+
+    sistema.procesador = procesador
+    assert sistema.buscar_entidad('Google') == {'a': 1}
+
+
+def top_k_exhaustivo(modelo, terminos, top_k):
+    consulta = set(terminos)
+    puntuaciones = (
+        (sum(pesos.get(t, 0.0) for t in consulta), doc_name)
+        for doc_name, pesos in modelo.pesos_bm25.items()
+    )
+    return [par for par in sorted(puntuaciones, reverse=True) if par[0] > 0][:top_k]
+
+
+@pytest.mark.parametrize("semilla", range(20))
+def test_bm25_terminacion_temprana_igual_a_exhaustivo(semilla):
+    aleatorio = random.Random(semilla)
+    modelo = construir_modelo(generar_corpus(documentos=120, vocabulario=300, longitud=80, semilla=semilla))
+    modelo.construir_indice_bm25()
+    vocabulario = [f"t{i}" for i in range(300)]
+
+    for _ in range(10):
+        consulta = aleatorio.sample(vocabulario, aleatorio.randint(1, 6))
+        top_k = aleatorio.choice([1, 3, 10, 500])  # 500 supera a los documentos que coinciden
+        resultados = modelo.buscar_bm25(consulta, top_k)
+        esperado = top_k_exhaustivo(modelo, consulta, top_k)
+
+        # Con empates el documento elegido puede variar: se comparan las puntuaciones
+        # y que cada documento devuelto tenga realmente la puntuación indicada
+        assert list(resultados.values) == pytest.approx([puntuacion for puntuacion, _ in esperado])
+        for doc_name, puntuacion in resultados.items():
+            pesos = modelo.pesos_bm25[doc_name]
+            assert sum(pesos.get(t, 0.0) for t in set(consulta)) == pytest.approx(puntuacion)
+
+
+def test_bm25_consulta_vacia_o_desconocida():
+    modelo = construir_modelo(generar_corpus(documentos=10, vocabulario=50, longitud=20))
+    assert modelo.buscar_bm25([], 5).empty
+    assert modelo.buscar_bm25(['no_existe'], 5).empty
+    assert modelo.buscar_bm25(['t0'], 0).empty
+
+
+@pytest.mark.parametrize("posiciones", [
+    [],
+    [0],
+    [0, 1, 2, 127, 128, 300, 16384, 16385, 2 ** 21 + 7, 2 ** 35],
+    sorted(random.Random(3).sample(range(10 ** 6), 200)),
+])
+def test_varbyte_ida_y_vuelta(posiciones):
+    assert decodificar_posiciones(codificar_posiciones(posiciones)) == posiciones
+
+
+def test_varbyte_deltas_grandes_usan_varios_bytes():
+    assert len(codificar_posiciones([127])) == 1
+    assert len(codificar_posiciones([128])) == 2
+    assert len(codificar_posiciones([100, 100 + 2 ** 14])) == 1 + 3
+
+
+def crear_indice(tokens, tamano_fragmento=None):
+    indice = IndicePosicional()
+    tamano_fragmento = tamano_fragmento or len(tokens) or 1
+    for inicio in range(0, len(tokens), tamano_fragmento):
+        indice.agregar('d', tokens[inicio:inicio + tamano_fragmento])
+    return indice
+
+
+def test_agregar_por_fragmentos_continua_las_posiciones():
+    aleatorio = random.Random(5)
+    tokens = [aleatorio.choice('abcde') for _ in range(2000)]
+    completo = crear_indice(tokens)
+    fragmentado = crear_indice(tokens, tamano_fragmento=137)
+
+    assert fragmentado.longitudes == {'d': 2000}
+    for termino in 'abcde':
+        esperado = [i for i, token in enumerate(tokens) if token == termino]
+        assert fragmentado.posiciones(termino, 'd') == esperado
+        assert completo.posiciones(termino, 'd') == esperado
+
+
+@pytest.mark.parametrize("longitud_frase", [3, 4, 5])
+def test_frases_largas_igual_a_fuerza_bruta(longitud_frase):
+    aleatorio = random.Random(longitud_frase)
+    tokens = [aleatorio.choice('abc') for _ in range(3000)]
+    indice = crear_indice(tokens, tamano_fragmento=500)
+
+    for _ in range(20):
+        frase = [aleatorio.choice('abc') for _ in range(longitud_frase)]
+        esperado = [i for i in range(len(tokens) - longitud_frase + 1) if tokens[i:i + longitud_frase] == frase]
+        assert indice.buscar_frase(frase).get('d', []) == esperado
+
+
+def test_frase_no_consecutiva_no_coincide():
+    indice = crear_indice(['machine', 'learning', 'deep', 'machine', 'x', 'learning'])
+    assert indice.buscar_frase(['machine', 'learning', 'deep']) == {'d': [0]}
+    assert indice.buscar_frase(['learning', 'machine']) == {}
+
+
+def test_cercania_admite_distancia_k_exacta():
+    # 'a' en 0 y 'b' en 3: distancia 3 (cuatro tokens)
+    indice = crear_indice(['a', 'x', 'x', 'b'])
+    assert indice.buscar_cercania(['a', 'b'], 3) == {'d': [(0, 3)]}
+    assert indice.buscar_cercania(['a', 'b'], 2) == {}
+    assert indice.buscar_cercania(['b', 'a'], 3) == {'d': [(0, 3)]}
+
+
+def test_cache_lru_expulsa_la_entrada_menos_usada():
+    cache = CacheLRU(capacidad=2)
+    cache.guardar('a', 1)
+    cache.guardar('b', 2)
+    assert cache.obtener('a') == 1  # 'a' pasa a ser la más reciente
+    cache.guardar('c', 3)
+
+    assert list(cache.datos) == ['a', 'c']
+    assert cache.obtener('b') is None
+    assert (cache.aciertos, cache.fallos) == (1, 1)
+    assert cache.tasa_aciertos() == pytest.approx(0.5)
+
+
+class ContadorLlamadas:
+    def __init__(self, funcion):
+        self.funcion = funcion
+        self.llamadas = 0
+
+    def __call__(self, *args):
+        self.llamadas += 1
+        return self.funcion(*args)
+
+
+def test_cache_consultas_dos_niveles_e_invalidacion():
+    cache = CacheConsultas(capacidad_terminos=10, capacidad_resultados=10)
+    normalizar = ContadorLlamadas(lambda consulta: consulta.lower().split())
+    buscar = ContadorLlamadas(lambda terminos, top_k: {'doc': float(len(terminos))})
+
+    def consultar(texto, version):
+        terminos = cache.obtener_terminos(texto, normalizar)
+        return cache.obtener_resultados(terminos, 5, version, buscar)
+
+    assert consultar("Machine learning", 1) == {'doc': 2.0}
+    assert consultar("Machine   learning", 1) == {'doc': 2.0}  # mismo texto normalizado
+    assert consultar("learning machine", 1) == {'doc': 2.0}  # mismo conjunto de términos
+    assert (normalizar.llamadas, buscar.llamadas) == (2, 1)
+
+    # Un cambio de versión del índice invalida los resultados, no los términos
+    assert consultar("Machine learning", 2) == {'doc': 2.0}
+    assert (normalizar.llamadas, buscar.llamadas) == (2, 2)
+
+    estadisticas = cache.estadisticas()
+    assert estadisticas['terminos']['aciertos'] == 2
+    assert estadisticas['terminos']['fallos'] == 2
+    assert estadisticas['resultados']['aciertos'] == 2
+    assert estadisticas['resultados']['fallos'] == 2
+    assert estadisticas['resultados']['tasa_aciertos'] == pytest.approx(0.5)
+    assert estadisticas['invalidaciones'] == 1
+
+
+def test_cache_consultas_devuelve_copias():
+    cache = CacheConsultas()
+    resultados = cache.obtener_resultados(('a',), 5, 1, lambda terminos, top_k: {'doc': 1.0})
+    resultados['doc'] = 99.0
+    assert cache.obtener_resultados(('a',), 5, 1, None) == {'doc': 1.0}
+
+
+def test_sistema_invalida_cache_al_agregar_documento():
+    sistema = crear_sistema()
+    sistema.agregar_documento('a', 'machine learning')
+    assert list(sistema.buscar('machine').index) == ['a']
+
+    sistema.agregar_documento('b', 'machine machine')
+    assert set(sistema.buscar('machine').index) == {'a', 'b'}
+
+
+def generar_texto_largo(semilla=11, palabras=3000):
+    aleatorio = random.Random(semilla)
+    vocabulario = ['alfa', 'beta', 'gamma', 'delta', 'contacto@empresa.com']
+    separadores = [' ', ' ', ' ', '. ', '\n', '\n\n']
+    return ''.join(aleatorio.choice(vocabulario) + aleatorio.choice(separadores) for _ in range(palabras))
+
+
+def test_documento_largo_cuenta_bigramas_entre_fragmentos_una_vez():
+    texto = generar_texto_largo()
+    sistema = crear_sistema()
+    sistema.procesador.max_caracteres_fragmento = 200
+    assert len(list(sistema.procesador.dividir_en_fragmentos(texto))) > 50
+
+    # Conteo de referencia sin fragmentar
+    tokens, emails = sistema.procesador.limpiar_y_lematizar(texto)
+    esperado = Counter(tokens) + Counter(sistema.procesador.generar_bigramas(tokens)) + Counter(emails)
+
+    sistema.agregar_documento('fragmentado', texto)
+    sistema.agregar_documento_largo('streaming', iter(texto.splitlines(keepends=True)))
+
+    assert sistema.modelo.documentos['fragmentado'] == esperado
+    assert sistema.modelo.documentos['streaming'] == esperado
+    assert sistema.emails_por_documento['streaming'] == emails
+    assert sistema.indice_posicional.longitudes['streaming'] == len(tokens)